@@ -1,171 +1,560 @@
 import gurobipy as gp
 from gurobipy import GRB
-import sys, itertools
+import argparse, hashlib, mmap, os, sys, itertools
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
 
+try:
+    from numba import njit, prange
+except ImportError:  # Numba est optionnel : repli sur NumPy
+    njit = None
 
-def read_file(fichier):
+
+# Les noms de variables et de contraintes ne sont transmis à Gurobi que pour le débogage
+# (SLIDESHOW_NOMS=1), afin de ne pas créer une chaîne par variable lors de la construction.
+NOMS = bool(os.environ.get("SLIDESHOW_NOMS"))
+
+
+def nom(name):
+    """Renvoie le nom donné si les noms sont activés, None sinon (Gurobi ne crée alors aucun nom)."""
+    return name if NOMS else None
+
+
+# Taille de fichier (en octets) à partir de laquelle la lecture est répartie sur plusieurs processus
+SEUIL_LECTURE_PARALLELE = 4 * 1024 * 1024
+
+
+def _parse_lines(fichier, debut, fin):
+    """
+    Analyse les lignes d’images comprises entre les octets [debut, fin) du fichier.
+    Les tags sont internés localement et renvoyés au format CSR : les identifiants locaux
+    des tags de l’image k sont indices[indptr[k]:indptr[k + 1]]. On renvoie aussi les
+    orientations et le vocabulaire local (tag par identifiant).
+    """
+    with open(fichier, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        orientations = []
+        longueurs = [0]
+        tags = []
+        for ligne in mm[debut:fin].split(b'\n'):
+            champs = ligne.split()
+            if not champs:
+                continue
+            orientations.append(champs[0].decode())
+            longueurs.append(len(champs) - 2)
+            tags.extend(champs[2:])
+    # Interning local : vocabulaire dans l’ordre de première apparition, puis traduction en bloc
+    vocabulaire = list(dict.fromkeys(tags))
+    tag_to_id = {t: k for k, t in enumerate(vocabulaire)}
+    indices = np.fromiter(map(tag_to_id.__getitem__, tags), dtype=np.int32, count=len(tags))
+    return orientations, np.cumsum(longueurs, dtype=np.int64), indices, vocabulaire
+
+
+@dataclass
+class Images:
+    """
+    Photos stockées par colonnes, une entrée par photo :
+      orientations : 'H' ou 'V'
+      lanes        : tags découpés en mots de 64 bits (bit k à 1 si la photo porte le tag d’indice k)
+      nb_tags      : nombre de tags distincts du fichier
+    """
+    orientations: np.ndarray
+    lanes: np.ndarray
+    nb_tags: int
+
+
+def read_file(fichier, workers=None):
+    """
+    Lit le fichier d’entrée. Les tags sont internés en entiers et les tags de chaque image
+    sont encodés en mots de 64 bits (voir Images).
+    Le fichier est projeté en mémoire ; au-delà de SEUIL_LECTURE_PARALLELE octets, les lignes
+    sont découpées en blocs analysés en parallèle, puis les vocabulaires des blocs sont fusionnés.
+    """
     try:
-        with open(fichier, 'r') as f:
-            nb_images = int(f.readline().strip())
-            images = {}
-            horizontales = []
-            verticales = []
-            for i in range(nb_images):
-                ligne = f.readline().strip().split()
-                orientation = ligne[0]
-                tags = set(ligne[2:])
-                images[i] = {'orientation': orientation, 'tags': tags}
-                if orientation == 'H':
-                    horizontales.append(i)
-                else:
-                    verticales.append(i)
-            return nb_images, images, horizontales, verticales
+        with open(fichier, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            fins = np.flatnonzero(np.frombuffer(mm, dtype=np.uint8) == ord('\n'))
+            nb_images = int(mm[:fins[0]] if len(fins) else mm[:])
+            taille = len(mm)
     except FileNotFoundError:
         print(f"Erreur: le fichier {fichier} est introuvable.")
         sys.exit(1)
 
+    # Découpage des lignes d’images en blocs : la ligne i commence après le (i+1)-ème saut de ligne
+    workers = workers or os.cpu_count() or 1
+    if taille < SEUIL_LECTURE_PARALLELE:
+        workers = 1
+    blocs = []
+    for lignes in np.array_split(np.arange(nb_images), workers):
+        if len(lignes):
+            debut = fins[lignes[0]] + 1
+            fin = fins[lignes[-1] + 1] if lignes[-1] + 1 < len(fins) else taille
+            blocs.append((int(debut), int(fin)))
+
+    if len(blocs) > 1:
+        with ProcessPoolExecutor(len(blocs)) as executor:
+            resultats = list(executor.map(_parse_lines, itertools.repeat(fichier), *zip(*blocs)))
+    else:
+        resultats = [_parse_lines(fichier, debut, fin) for debut, fin in blocs]
+
+    # Fusion des vocabulaires locaux en un interning global : les identifiants locaux de chaque
+    # bloc sont traduits en une seule indexation, puis (image, tag) repérés en vecteurs.
+    tag_to_id = {}
+    orientations, lignes, tags = [], [], []
+    premiere = 0
+    for orientations_bloc, indptr, indices, vocabulaire in resultats:
+        remap = np.array([tag_to_id.setdefault(t, len(tag_to_id)) for t in vocabulaire], dtype=np.int64)
+        orientations += orientations_bloc
+        lignes.append(premiere + np.repeat(np.arange(len(orientations_bloc)), np.diff(indptr)))
+        tags.append(remap[indices])
+        premiere += len(orientations_bloc)
+    lignes = np.concatenate(lignes) if lignes else np.zeros(0, dtype=np.int64)
+    tags = np.concatenate(tags) if tags else np.zeros(0, dtype=np.int64)
+
+    nb_tags = len(tag_to_id)
+    lanes = np.zeros((premiere, max(1, (nb_tags + 63) // 64)), dtype=np.uint64)
+    np.bitwise_or.at(lanes, (lignes, tags // 64), np.left_shift(np.uint64(1), (tags % 64).astype(np.uint64)))
+
+    orientations = np.array(orientations, dtype='U1')
+    horizontales = np.flatnonzero(orientations == 'H').tolist()
+    verticales = np.flatnonzero(orientations != 'H').tolist()
+    return nb_images, Images(orientations, lanes, nb_tags), horizontales, verticales
+
+
+@dataclass
+class Candidates:
+    """
+    Slides candidates stockées par colonnes, une entrée par slide :
+      types  : 'H' ou 'V'
+      photos : indices des photos, -1 en seconde colonne pour une slide horizontale
+      tags   : matrice booléenne slide x tag (voir build_tag_matrix)
+    """
+    types: np.ndarray
+    photos: np.ndarray
+    tags: np.ndarray
+
+    def __len__(self):
+        return len(self.types)
+
+    def slide(self, s):
+        """Photos composant la slide s, au format de sortie."""
+        return tuple(int(p) for p in self.photos[s] if p >= 0)
 
-def score_transition(tags1, tags2):
-    """Calcule le score d’une transition entre deux slides."""
-    commun = len(tags1 & tags2)
-    diff1 = len(tags1 - tags2)
-    diff2 = len(tags2 - tags1)
-    return min(commun, diff1, diff2)
 
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _unions_paires(lanes, premieres, secondes):
+        """Noyau Numba : union des tags (OU bit à bit) et nombre de tags de chaque paire."""
+        nb_paires, nb_mots = len(premieres), lanes.shape[1]
+        unions = np.empty((nb_paires, nb_mots), dtype=np.uint64)
+        tailles = np.zeros(nb_paires, dtype=np.int64)
+        for p in prange(nb_paires):
+            for k in range(nb_mots):
+                mot = lanes[premieres[p], k] | lanes[secondes[p], k]
+                unions[p, k] = mot
+                while mot:
+                    mot &= mot - np.uint64(1)
+                    tailles[p] += 1
+        return unions, tailles
+else:
+    def _unions_paires(lanes, premieres, secondes):
+        """Union des tags (OU bit à bit) et nombre de tags de chaque paire, avec NumPy."""
+        unions = lanes[premieres] | lanes[secondes]
+        return unions, np.bitwise_count(unions).sum(axis=1, dtype=np.int64)
 
-def build_candidate_slides(images, horizontales, verticales):
+
+def build_candidate_slides(images, horizontales, verticales, bande=None):
     """
-    Crée la liste des slides candidates en générant toutes les associations de slides verticales possibles.
-      - Pour les photos horizontales, la slide est (i,) avec ses tags.
+    Crée les slides candidates en générant toutes les associations de slides verticales possibles.
+      - Pour les photos horizontales, la slide est (i, -1) avec ses tags.
       - Pour les photos verticales, pour chaque paire (i,j) (i<j) on crée une slide candidate (i,j)
         avec l’union des tags.
-    Chaque candidate est un dictionnaire avec :
-      'type'   : 'H' ou 'V'
-      'photos' : tuple d’indices de photo
-      'tags'   : ensemble de tags
-    """
-    candidates = []
-    # Slides horizontales (toujours sélectionnées)
-    for i in horizontales:
-        candidates.append({
-            'type': 'H',
-            'photos': (i,),
-            'tags': images[i]['tags']
-        })
-    # Slides candidates verticales (sélectionné ou non)
-    for i, j in itertools.combinations(verticales, 2):
-        tags_union = images[i]['tags'] | images[j]['tags']
-        candidates.append({
-            'type': 'V',
-            'photos': (i, j),
-            'tags': tags_union
-        })
-    return candidates
-
-
-def build_model(images, horizontales, verticales):
+    Les tags sont manipulés par mots de 64 bits ; les unions des paires verticales sont calculées
+    par _unions_paires (compilé avec Numba s’il est disponible).
+    Les paires verticales qui ne peuvent rapporter aucun point sont écartées. Si `bande` est
+    donnée, on ne garde de plus que les paires dont le nombre de tags est à moins de
+    bande * médiane du nombre de tags des photos horizontales, ou des paires verticales s’il n’y a
+    aucune photo horizontale (élagage heuristique).
+    """
+    # Slides horizontales (toujours sélectionnées) puis slides candidates verticales (sélectionnées ou non)
+    paires = np.column_stack(np.triu_indices(len(verticales), 1)).astype(np.int64)
+    verticales = np.array(verticales, dtype=np.int64)
+    photos = np.concatenate([
+        np.column_stack([np.array(horizontales, dtype=np.int64), np.full(len(horizontales), -1)]),
+        verticales[paires]
+    ])
+    types = np.repeat(np.array(['H', 'V']), [len(horizontales), len(paires)])
+    lanes_h = images.lanes[horizontales]
+    lanes_v = images.lanes[verticales]
+    unions, tailles_v = _unions_paires(lanes_v, paires[:, 0], paires[:, 1])
+    lanes = np.concatenate([lanes_h, unions])
+
+    # --- Élagage des slides verticales ---
+    # Le score d’une transition impliquant une slide est au plus min(|tags|, |tags de l’autre|) // 2.
+    # Une slide verticale dont cette borne est nulle pour toute autre slide n’apporte rien :
+    # la retirer du chemin ne peut jamais diminuer le score, on l’écarte donc sans perte.
+    tailles = np.concatenate([np.bitwise_count(lanes_h).sum(axis=1, dtype=np.int64), tailles_v])
+    second_max = np.sort(tailles)[-2] if len(tailles) > 1 else 0
+    # Taille de référence de la bande : médiane des slides horizontales, ou à défaut des paires verticales.
+    tailles_reference = tailles[:len(horizontales)] if len(horizontales) else tailles_v
+    reference = np.median(tailles_reference) if len(tailles_reference) else 0
+    # Seule la plus grande slide a pour meilleur voisin possible la deuxième plus grande.
+    garder = np.minimum(tailles, second_max) // 2 > 0
+    if bande is not None:
+        garder &= np.abs(tailles - reference) <= bande * reference
+    garder |= types == 'H'
+    # Un diaporama contient au moins une slide : si tout a été écarté, on garde la paire la plus riche.
+    if len(garder) and not garder.any():
+        garder[np.argmax(tailles)] = True
+
+    return Candidates(types[garder], photos[garder], build_tag_matrix(lanes[garder], images.nb_tags))
+
+
+def build_tag_matrix(lanes, nb_tags):
+    """
+    Encode les tags des slides candidates dans une matrice booléenne T :
+    une ligne par candidate, une colonne par tag interné (dépliage des mots de 64 bits).
+    """
+    bits = np.unpackbits(np.ascontiguousarray(lanes, dtype='<u8').view(np.uint8), axis=1, bitorder='little')
+    return bits[:, :nb_tags].astype(bool)
+
+
+def cost_matrix(T):
+    """
+    Calcule en une seule passe le score de transition entre toutes les paires de slides.
+    Les slides ayant exactement les mêmes tags partagent leurs scores : le calcul est fait
+    une seule fois par ensemble de tags distinct, puis redistribué.
+    Le nombre de tags communs est obtenu par un produit matriciel (BLAS) ; le calcul
+    en float32 reste exact tant que le nombre de tags est inférieur à 2**24.
+    """
+    distincts, inverse = np.unique(T, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    Tf = distincts.astype(np.float32)
+    commun = (Tf @ Tf.T).astype(np.int32)
+    taille = distincts.sum(axis=1, dtype=np.int32)
+    diff1 = taille[:, None] - commun
+    diff2 = taille[None, :] - commun
+    return np.minimum(commun, np.minimum(diff1, diff2))[np.ix_(inverse, inverse)]
+
+
+def build_arcs(cost, voisins=None, order=()):
+    """
+    Construit la liste des arcs autorisés du graphe start (0) -> slides (1..n) -> end (n+1),
+    sous forme de deux tableaux (origines, destinations) : d’abord les arcs start -> i,
+    puis les arcs entre slides, enfin les arcs i -> end.
+    Si `voisins` est donné, on ne garde entre slides que les arcs (i,j) tels que j soit parmi
+    les `voisins` meilleures transitions depuis i, ou i parmi celles depuis j, ainsi que les
+    arcs du chemin `order` (qui garantit qu’une solution réalisable reste dans le graphe).
+    Le nombre de variables d’arc passe de n² à O(voisins·n), au prix d’une possible perte
+    d’optimalité. Avec `voisins` = 0, seuls les arcs du chemin `order` sont conservés.
+    """
+    n = len(cost)
+    reels = np.arange(1, n + 1)
+    if voisins is None or voisins >= n - 1:
+        origines, destinations = np.nonzero(~np.eye(n, dtype=bool))
+    else:
+        # On exclut la boucle i -> i en lui donnant un coût inférieur à tous les autres.
+        couts = cost.astype(np.int64)
+        np.fill_diagonal(couts, -1)
+        if voisins > 0:
+            meilleurs = np.argpartition(-couts, voisins - 1, axis=1)[:, :voisins].ravel()
+        else:
+            meilleurs = np.empty(0, dtype=np.int64)
+        lignes = np.repeat(np.arange(n), voisins)
+        order = np.asarray(order, dtype=np.int64)
+        origines = np.concatenate([lignes, meilleurs, order[:-1]])
+        destinations = np.concatenate([meilleurs, lignes, order[1:]])
+        cles = np.unique(origines * n + destinations)
+        origines, destinations = cles // n, cles % n
+    origines = np.concatenate([np.zeros(n, dtype=np.int64), origines + 1, reels])
+    destinations = np.concatenate([reels, destinations + 1, np.full(n, n + 1)])
+    return origines, destinations
+
+
+def arc_index(arcs, n, origines, destinations):
+    """Indice de chaque arc (origines[k], destinations[k]) dans `arcs`, ou -1 s’il n’existe pas."""
+    cles = arcs[0] * (n + 2) + arcs[1]
+    cherchees = np.asarray(origines, dtype=np.int64) * (n + 2) + np.asarray(destinations, dtype=np.int64)
+    if not len(cles):
+        return np.full(len(cherchees), -1)
+    ordre = np.argsort(cles)
+    rangs = np.searchsorted(cles, cherchees, sorter=ordre)
+    indices = ordre[np.minimum(rangs, len(cles) - 1)]
+    return np.where(cles[indices] == cherchees, indices, -1)
+
+
+def greedy_solution(candidates, cost):
+    """
+    Construit rapidement un diaporama réalisable, utilisé comme solution de départ :
+      - toutes les slides horizontales, puis les paires verticales par nombre de tags décroissant
+        tant que leurs deux photos sont encore libres ;
+      - ordre obtenu par plus proche voisin : on enchaîne à chaque fois la slide restante
+        offrant la meilleure transition depuis la slide courante.
+    Renvoie l’ordre des slides choisies (indices de candidates).
+    """
+    choisies = np.flatnonzero(candidates.types == 'H').tolist()
+    utilisees = set()
+    verticales = np.flatnonzero(candidates.types == 'V')
+    tailles = candidates.tags.sum(axis=1)
+    verticales_triees = verticales[np.argsort(-tailles[verticales], kind='stable')]
+    for s, (i, j) in zip(verticales_triees.tolist(), candidates.photos[verticales_triees].tolist()):
+        if i not in utilisees and j not in utilisees:
+            utilisees.update((i, j))
+            choisies.append(s)
+    if not choisies:
+        return []
+
+    restantes = np.zeros(len(candidates), dtype=bool)
+    restantes[choisies] = True
+    current = choisies[0]
+    restantes[current] = False
+    order = [current]
+    for _ in range(len(choisies) - 1):
+        current = int(np.where(restantes, cost[current], -1).argmax())
+        restantes[current] = False
+        order.append(current)
+    return order
+
+
+def set_start(x, z, arcs, order, n, pos=None):
+    """
+    Fixe la solution de départ de Gurobi (attribut Start) au chemin start -> order -> end.
+    Si une transition du chemin n’est pas parmi les arcs du modèle, seules les slides
+    choisies sont fournies et Gurobi complète lui-même l’ordre.
+    """
+    z_start = np.zeros(n)
+    z_start[order] = 1
+    chemin = np.array([0] + [s + 1 for s in order] + [n + 1])
+    indices = arc_index(arcs, n, chemin[:-1], chemin[1:])
+    z.Start = z_start
+    if (indices >= 0).all():
+        x_start = np.zeros(len(arcs[0]))
+        x_start[indices] = 1
+        x.Start = x_start
+    if pos is not None:
+        # Les positions des slides non choisies sont laissées libres.
+        pos_start = np.full(n, GRB.UNDEFINED)
+        pos_start[order] = np.arange(1, len(order) + 1)
+        pos.Start = pos_start
+
+
+class ModelCache:
+    """
+    Cache disque des modèles construits, indexé par une empreinte des slides candidates et de
+    leurs coûts de transition : {dossier}/{cle}.mps contient le modèle, {dossier}/{cle}.sol la
+    dernière solution trouvée, rechargée comme solution de départ (attribut Start).
+    """
+
+    def __init__(self, dossier, candidates, cost, arcs, mtz=False):
+        empreinte = hashlib.blake2b(cost.tobytes(), digest_size=16)
+        empreinte.update(candidates.types.tobytes())
+        empreinte.update(candidates.photos.tobytes())
+        empreinte.update(arcs[0].tobytes())
+        empreinte.update(arcs[1].tobytes())
+        empreinte.update(b"mtz" if mtz else b"lazy")
+        self.cle = empreinte.hexdigest()
+        self.chemin_modele = os.path.join(dossier, f"{self.cle}.mps")
+        self.chemin_solution = os.path.join(dossier, f"{self.cle}.sol")
+        os.makedirs(dossier, exist_ok=True)
+
+    def load(self):
+        """Relit le modèle en cache (ou None s’il est absent) et lui applique la solution précédente."""
+        if not os.path.exists(self.chemin_modele):
+            return None
+        model = gp.read(self.chemin_modele)
+        if os.path.exists(self.chemin_solution):
+            model.read(self.chemin_solution)
+        return model
+
+    def save_model(self, model):
+        model.write(self.chemin_modele)
+
+    def save_solution(self, model):
+        if model.SolCount > 0:
+            model.write(self.chemin_solution)
+
+
+def build_model(images, horizontales, verticales, bande=None, cache_dir=None, mtz=False, voisins=None):
     # Construction des slides candidates
-    candidates = build_candidate_slides(images, horizontales, verticales)
+    candidates = build_candidate_slides(images, horizontales, verticales, bande)
+    n = len(candidates)  # 0: start, 1..n: slides, n+1: end
+
+    # --- Coûts de transition ---
+    # Pour deux slides candidates s et t (indices 0..n-1), le coût est pré-calculé à partir de leurs tags.
+    cost = cost_matrix(candidates.tags)
+    # Solution gloutonne : solution de départ, et chemin toujours conservé parmi les arcs
+    order = greedy_solution(candidates, cost)
+    arcs = build_arcs(cost, voisins, order)
+
+    # Réutilisation d’un modèle identique déjà construit lors d’une exécution précédente
+    cache = ModelCache(cache_dir, candidates, cost, arcs, mtz) if cache_dir else None
+    model = cache.load() if cache else None
+    if model is None:
+        model, x, z, pos = build_formulation(candidates, cost, arcs, mtz)
+        if cache:
+            cache.save_model(model)
+        # Démarrage à chaud avec une solution gloutonne (un modèle relu du cache
+        # repart quant à lui de la dernière solution enregistrée).
+        set_start(x, z, arcs, order, n, pos)
+    else:
+        # Les variables sont relues dans leur ordre de création : z puis x.
+        variables = model.getVars()
+        z = gp.MVar.fromlist(variables[:n])
+        x = gp.MVar.fromlist(variables[n:n + len(arcs[0])])
+
+    # --- Élimination des sous-tournées ---
+    # Sans MTZ, les contraintes sont ajoutées paresseusement par subtour_callback, uniquement
+    # lorsqu’une solution entière contient un cycle disjoint du chemin start -> end.
+    if not mtz:
+        model.Params.LazyConstraints = 1
+        model._x = x
+        model._arcs = arcs
+
+    return model, x, z, arcs, candidates, cost, n, cache
+
+
+def build_formulation(candidates, cost, arcs, mtz=False):
+    """
+    Crée le modèle Gurobi (variables, objectif et contraintes) pour les slides candidates.
+    Une variable d’arc x[k] est créée pour chaque arc autorisé (arcs[0][k], arcs[1][k]).
+    Si `mtz` est vrai, les sous-tournées sont éliminées dès la construction par des contraintes
+    MTZ relevées (Desrochers-Laporte) sur des variables de position ; sinon pos vaut None et
+    l’élimination est laissée à subtour_callback.
+    """
     num_candidates = len(candidates)
 
     model = gp.Model("Diaporama")
 
     # --- Variables de décision de slide candidates ---
     # Pour une slide candidate s, z[s] = 1 si elle est utilisée.
-    # Pour une slide horizontale, z est fixé à 1.
-    z = {}
-    for s in range(num_candidates):
-        if candidates[s]['type'] == 'H':
-            z[s] = model.addVar(vtype=GRB.BINARY, lb=1, ub=1, name=f"z_{s}")
-        else:
-            z[s] = model.addVar(vtype=GRB.BINARY, name=f"z_{s}")
-    model.update()
-
-    # Contrainte de couplage pour les verticales :
-    # Chaque photo verticale peut apparaître dans au plus une slide verticale choisie.
-    for photo in verticales:
-        candidates_lies = [s for s in range(num_candidates)
-                        if candidates[s]['type'] == 'V' and photo in candidates[s]['photos']]
-        if candidates_lies:
-            model.addConstr(gp.quicksum(z[s] for s in candidates_lies) <= 1, name=f"unicite_{photo}")
+    # Pour une slide horizontale, z est fixé à 1 (borne inférieure à 1).
+    z_lb = (candidates.types == 'H').astype(float)
+    z = model.addMVar(num_candidates, vtype=GRB.BINARY, lb=z_lb, name=nom("z"))
 
     # --- Ordonnancement des slides sélectionnées ---
     # On définit les noeuds réels correspondant aux slides candidates et des noeuds fictifs start et end
     # On va créer un chemin de start -> noeuds réels -> end
     n = num_candidates
-    nodes = list(range(0, n + 2))  # 0: start, 1..n: slides, n+1: end
-
-    # Variables d'arc x[i,j] pour i,j dans nodes avec (i != j)
-    x = {}
-    for i in nodes:
-        for j in nodes:
-            if i != j:
-                x[i, j] = model.addVar(vtype=GRB.BINARY, name=f"x_{i}_{j}")
-    model.update()
-
-    # Variables de position des slides dans le diaporama (seulement pour les noeuds réels 1..n)
-    pos = {}
-    for i in range(1, n + 1):
-        pos[i] = model.addVar(vtype=GRB.INTEGER, lb=1, ub=n, name=f"pos_{i}")
-    model.update()
 
-    # --- Coûts de transition ---
-    # Pour deux slides candidates s et t (indices 0..n-1), le coût est pré-calculé à partir de leurs tags.
-    cost = {}
-    for s in range(n):
-        for t in range(n):
-            if s != t:
-                cost[s, t] = score_transition(candidates[s]['tags'], candidates[t]['tags'])
+    # Variables d'arc, uniquement pour les arcs autorisés : ni boucle, ni arc entrant au start,
+    # ni arc sortant du end, ni arc direct start -> end.
+    origines, destinations = arcs
+    nb_arcs = len(origines)
+    x = model.addMVar(nb_arcs, vtype=GRB.BINARY, name=nom("x"))
+    # Matrices d’incidence noeud x arc des arcs sortants et entrants
+    sortants = csr_matrix((np.ones(nb_arcs), (origines, np.arange(nb_arcs))), shape=(n + 2, nb_arcs))
+    entrants = csr_matrix((np.ones(nb_arcs), (destinations, np.arange(nb_arcs))), shape=(n + 2, nb_arcs))
+
+    # Contrainte de couplage pour les verticales :
+    # Chaque photo verticale peut apparaître dans au plus une slide verticale choisie.
+    # Matrice d’incidence photo x slide candidate verticale, restreinte aux photos présentes.
+    v = np.flatnonzero(candidates.types == 'V')
+    photos, lignes = np.unique(candidates.photos[v].ravel(), return_inverse=True)
+    couplage = csr_matrix((np.ones(2 * len(v)), (lignes, np.repeat(v, 2))), shape=(len(photos), n))
+    model.addConstr(couplage @ z <= 1, name=nom("unicite"))
 
     # --- Fonction objectif ---
     # L’objectif est de maximiser la somme des scores sur les arcs entre noeuds réels.
     # (Les arcs partant du start et allant vers le end ont un coût nul.)
-    model.setObjective(
-        gp.quicksum(cost[i - 1, j - 1] * x[i, j] for i in range(1, n + 1) for j in range(1, n + 1) if i != j),
-        GRB.MAXIMIZE
-    )
+    # Les coefficients sont transmis en un seul appel, alignés sur x.
+    reels = (origines >= 1) & (origines <= n) & (destinations >= 1) & (destinations <= n)
+    c = np.zeros(nb_arcs)
+    c[reels] = cost[origines[reels] - 1, destinations[reels] - 1]
+    model.setMObjective(None, c, 0.0, xc=x, sense=GRB.MAXIMIZE)
 
     # --- Contraintes d’ordonnancement ---
     # start (0) : exactement un arc sortant vers un noeud réel.
-    model.addConstr(gp.quicksum(x[0, j] for j in range(1, n + 1)) == 1, name="sortie_start")
+    model.addConstr(sortants[[0]] @ x == 1, name=nom("sortie_start"))
     # end (n+1) : exactement un arc entrant depuis un noeud réel.
-    model.addConstr(gp.quicksum(x[i, n + 1] for i in range(1, n + 1)) == 1, name="entree_end")
+    model.addConstr(entrants[[n + 1]] @ x == 1, name=nom("entree_end"))
 
     # Pour chaque noeud réel i (correspondant à la slide candidate d’indice i-1) :
     # Le degré entrant et sortant doit être égal à z[i-1] (si la slide est sélectionnée, alors 1, sinon 0).
-    for i in range(1, n + 1):
-        model.addConstr(gp.quicksum(x[j, i] for j in nodes if j != i) == z[i - 1], name=f"noeud_{i}_entrant")
-        model.addConstr(gp.quicksum(x[i, j] for j in nodes if j != i) == z[i - 1], name=f"noeud_{i}_sortant")
+    model.addConstr(entrants[1:n + 1] @ x == z, name=nom("noeud_entrant"))
+    model.addConstr(sortants[1:n + 1] @ x == z, name=nom("noeud_sortant"))
+
+    pos = None
+    if mtz:
+        # Variables de position des slides dans le diaporama (seulement pour les noeuds réels 1..n)
+        pos = model.addMVar(n, vtype=GRB.INTEGER, lb=1, ub=n, name=nom("pos"))
+        # --- Contraintes MTZ relevées de Desrochers-Laporte ---
+        # Pour chaque arc (i,j) entre slides :
+        # pos[i] - pos[j] + n x[i,j] + (n-2) x[j,i] <= n-1 : si x[i,j] = 1, pos[j] = pos[i] + 1.
+        # Si l’arc inverse (j,i) n’existe pas, on garde la contrainte MTZ simple.
+        k = np.flatnonzero(reels)
+        inverses = arc_index(arcs, n, destinations[k], origines[k])
+        avec, sans = inverses >= 0, inverses < 0
+        i, j = origines[k] - 1, destinations[k] - 1
+        model.addConstr(pos[i[avec]] - pos[j[avec]] + n * x[k[avec]] + (n - 2) * x[inverses[avec]] <= n - 1,
+                        name=nom("MTZ"))
+        model.addConstr(pos[i[sans]] - pos[j[sans]] + n * x[k[sans]] <= n - 1, name=nom("MTZ_simple"))
+        # La première slide est en position 1, les suivantes en position 2 ou plus
+        # (les n premiers arcs sont les arcs start -> 1..n).
+        model.addConstr(pos <= n - (n - 1) * x[:n], name=nom("MTZ_premiere"))
+        model.addConstr(pos >= 2 - x[:n], name=nom("MTZ_suivantes"))
 
-    # On interdit tout arc entrant au start et sortant du end.
-    model.addConstr(gp.quicksum(x[i, 0] for i in nodes if i != 0) == 0, name="prec_start")
-    model.addConstr(gp.quicksum(x[n + 1, j] for j in nodes if j != n + 1) == 0, name="succ_end")
+    return model, x, z, pos
 
-    # --- Contraintes MTZ pour éliminer les sous-tournées (sur les noeuds réels uniquement) ---
-    for i in range(1, n + 1):
-        for j in range(1, n + 1):
-            if i != j:
-                model.addConstr(pos[i] - pos[j] + n * x[i, j] <= n - 1, name=f"MTZ_{i}_{j}")
 
-    model.update()
-    return model, x, pos, z, candidates, n
+def set_parameters(model, threads=None, mip_focus=1, cuts=2, heuristics=0.2, mip_gap=0.05,
+                   presolve=-1, time_limit=None):
+    """
+    Règle les paramètres de Gurobi pour ce problème de chemin à variables binaires :
+    priorité à la recherche de solutions réalisables (MIPFocus=1), coupes agressives
+    et un peu plus de temps consacré aux heuristiques.
+    """
+    model.Params.Threads = threads or os.cpu_count() or 0
+    model.Params.MIPFocus = mip_focus
+    model.Params.Cuts = cuts
+    model.Params.Heuristics = heuristics
+    model.Params.MIPGap = mip_gap
+    model.Params.Presolve = presolve
+    if time_limit is not None:
+        model.Params.TimeLimit = time_limit
 
 
-def get_solution(x, n):
+def subtour_callback(model, where):
+    """
+    Callback Gurobi : pour chaque solution entière trouvée, cherche les composantes connexes
+    du graphe des arcs sélectionnés. Toute composante ne contenant pas le start est un
+    sous-tour S, que l’on coupe par la contrainte sum(x[i,j], i,j dans S) <= |S| - 1.
+    """
+    if where != GRB.Callback.MIPSOL:
+        return
+    x = model._x
+    origines, destinations = model._arcs
+    choisis = model.cbGetSolution(x) > 0.5
+    nb_noeuds = int(destinations.max()) + 1  # le end est le noeud de plus grand indice
+    support = csr_matrix((np.ones(choisis.sum()), (origines[choisis], destinations[choisis])),
+                         shape=(nb_noeuds, nb_noeuds))
+    _, labels = connected_components(support, directed=True, connection='weak')
+    actifs = np.zeros(nb_noeuds, dtype=bool)
+    actifs[origines[choisis]] = True
+    actifs[destinations[choisis]] = True
+    for label in np.unique(labels[actifs]):
+        if label == labels[0]:
+            continue
+        dans_S = labels == label
+        internes = np.flatnonzero(dans_S[origines] & dans_S[destinations])
+        model.cbLazy(x[internes].sum() <= dans_S.sum() - 1)
+
+
+def get_solution(x, arcs, n):
     """
     Extrait l'ordre des noeuds réels (indices de slides candidates, de 0 à n-1)
     en partant du start jusqu'au noeud end
     """
+    # Lecture de toute la solution en un seul appel, puis successeur de chaque noeud (-1 si aucun)
+    origines, destinations = arcs
+    selection = x.X > 0.5
+    successeur = np.full(n + 2, -1)
+    successeur[origines[selection]] = destinations[selection]
     order = []
     current = 0
-    while current != n + 1:
-        for j in range(n + 2):
-            if current != j and x[current, j].X == 1:
-                order.append(j)
-                current = j
-                break
-        else:
-            break
+    while current != n + 1 and successeur[current] >= 0 and len(order) <= n + 1:
+        current = int(successeur[current])
+        order.append(current)
     # On retire les noeuds fictifs s’ils apparaissent
     if order and order[0] == 0:
         order = order[1:]
@@ -176,35 +565,99 @@ def get_solution(x, n):
     return candidate_order
 
 
+def write_solution(fichier, slides):
+    """Écrit le diaporama au format de sortie en une seule écriture (contenu préparé en mémoire)."""
+    buf = bytearray(f"{len(slides)}\n".encode())
+    for slide in slides:
+        buf += " ".join(map(str, slide)).encode()
+        buf.append(ord('\n'))
+    with open(fichier, "wb") as f:
+        f.write(buf)
+
+
+def entier_positif(valeur):
+    """Type argparse : entier supérieur ou égal à 0."""
+    n = int(valeur)
+    if n < 0:
+        raise argparse.ArgumentTypeError(f"{valeur} n’est pas un entier positif ou nul")
+    return n
+
+
+def reel_positif(valeur):
+    """Type argparse : réel supérieur ou égal à 0."""
+    x = float(valeur)
+    if not x >= 0:
+        raise argparse.ArgumentTypeError(f"{valeur} n’est pas un réel positif ou nul")
+    return x
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Construction d’un diaporama optimal avec Gurobi.")
+    parser.add_argument("dataset", help="fichier d’entrée décrivant les photos")
+    parser.add_argument("--bande", type=reel_positif, default=None,
+                        help="ne garde que les paires verticales dont le nombre de tags est à moins de "
+                             "BANDE * médiane du nombre de tags des photos horizontales (ou des paires "
+                             "verticales en l’absence de photo horizontale)")
+    parser.add_argument("--cache", default=None, metavar="DOSSIER",
+                        help="dossier où conserver les modèles construits et leurs solutions "
+                             "pour les réutiliser (démarrage à chaud) lors des exécutions suivantes")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="nombre de threads utilisés par Gurobi (par défaut : tous les coeurs)")
+    parser.add_argument("--mip-focus", type=int, default=1, choices=[0, 1, 2, 3],
+                        help="paramètre MIPFocus de Gurobi (1 : recherche de solutions réalisables)")
+    parser.add_argument("--cuts", type=int, default=2, choices=[-1, 0, 1, 2, 3],
+                        help="paramètre Cuts de Gurobi (2 : génération de coupes agressive)")
+    parser.add_argument("--heuristics", type=float, default=0.2,
+                        help="part du temps consacrée aux heuristiques (paramètre Heuristics)")
+    parser.add_argument("--mip-gap", type=float, default=0.05,
+                        help="écart relatif d’optimalité auquel la résolution s’arrête (paramètre MIPGap)")
+    parser.add_argument("--presolve", type=int, default=-1, choices=[-1, 0, 1, 2],
+                        help="niveau de prétraitement de Gurobi (paramètre Presolve, -1 : automatique)")
+    parser.add_argument("--time-limit", type=float, default=None,
+                        help="temps de résolution maximal en secondes")
+    parser.add_argument("--voisins", type=entier_positif, default=20,
+                        help="nombre d’arcs sortants de plus fort coût conservés pour chaque slide "
+                             "(0 : seuls les arcs du chemin glouton initial sont conservés)")
+    parser.add_argument("--dense", action="store_true",
+                        help="conserve tous les arcs entre slides (pas de restriction aux plus proches voisins)")
+    parser.add_argument("--mtz", action="store_true",
+                        help="élimine les sous-tournées par des contraintes MTZ relevées plutôt que "
+                             "par des contraintes paresseuses")
+    args = parser.parse_args()
+
+    nb_photos, images, horizontales, verticales = read_file(args.dataset)
 
-    dataset = sys.argv[1]
-    nb_photos, images, horizontales, verticales = read_file(dataset)
+    # Sans photo horizontale ni paire de photos verticales, aucune slide n’est possible :
+    # le diaporama est vide et il n’y a rien à optimiser.
+    if not horizontales and len(verticales) < 2:
+        write_solution("slideshow.sol", [])
+        sys.exit(0)
 
-    model, x, pos, z, candidates, n = build_model(images, horizontales, verticales)
-    model.optimize()
+    model, x, z, arcs, candidates, cost, n, cache = build_model(images, horizontales, verticales, args.bande,
+                                                                args.cache, args.mtz,
+                                                                None if args.dense else args.voisins)
+    set_parameters(model, args.threads, args.mip_focus, args.cuts, args.heuristics, args.mip_gap,
+                   args.presolve, args.time_limit)
+    if args.mtz:
+        model.optimize()
+    else:
+        model.optimize(subtour_callback)
+    if cache:
+        cache.save_solution(model)
 
     # Extraction de l’ordre d’ordonnancement parmi les slides sélectionnées
-    slide_order = get_solution(x, n)
+    slide_order = get_solution(x, arcs, n)
 
     # Calcul du score total sur la partie ordonnancement (transitions entre slides sélectionnées)
-    total_score = 0
-    for i in range(len(slide_order) - 1):
-        s = slide_order[i]
-        t = slide_order[i + 1]
-        total_score += score_transition(candidates[s]['tags'], candidates[t]['tags'])
+    total_score = int(cost[slide_order[:-1], slide_order[1:]].sum())
 
     # Construction du diaporama final à partir de l'ordre extrait
     # Seules les slides dont z[s] est activé (pour les slides verticales, cela respecte la contrainte de couplage)
     final_slideshow = []
     for i in slide_order:
         if z[i].X == 1:
-            final_slideshow.append(candidates[i]['photos'])
+            final_slideshow.append(candidates.slide(i))
 
     # Écriture dans un fichier .sol
-    with open("slideshow.sol", "w") as f:
-        f.write(f"{len(final_slideshow)}\n")
-        for slide in final_slideshow:
-            f.write(" ".join(map(str, slide)) + "\n")
+    write_solution("slideshow.sol", final_slideshow)
+    print(f"Score total : {total_score}")